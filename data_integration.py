@@ -1,6 +1,18 @@
+import numpy as np
+
 # Optionally, filter interactions using a global threshold.
-global_threshold = merged_interactions['confidence_score'].quantile(0.10)
-final_df = merged_interactions[merged_interactions['confidence_score'] >= global_threshold]
+# The 10th-percentile score is found by partial selection (O(N)) rather than a full sort.
+all_scores = merged_interactions['confidence_score'].to_numpy(dtype=float)
+scores = all_scores[~np.isnan(all_scores)]
+if len(scores) == 0:
+    global_threshold = np.nan
+else:
+    k = int(0.10 * len(scores))
+    global_threshold = np.partition(scores, k)[k]
+# Unscored edges (NaN confidence_score: miRTarBase, miRcode) are experimentally
+# validated or curated, so they bypass the score threshold rather than being dropped.
+keep = np.isnan(all_scores) | (all_scores >= global_threshold)
 
-# Save the final merged interaction data.
-final_df.to_csv('data/final_ceRNA_interactions.csv', index=False)
+# Save the final merged interaction data, writing only the output columns of the kept rows.
+merged_interactions.loc[keep, ['source', 'target', 'confidence_score', 'source_db']].to_parquet(
+    'data/final_ceRNA_interactions.parquet', compression='zstd', index=False)
@@ -0,0 +1,16 @@
+"""
+Shared file-opening helpers for the ceRNA pipeline scripts.
+"""
+
+try:
+    # ISA-L backed gzip is a drop-in replacement and inflates much faster
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
+
+def open_input(path: str):
+    """Open a file for binary reading, decompressing `.gz` files with igzip when available."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
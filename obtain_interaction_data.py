@@ -7,9 +7,23 @@ parses and filters them for high-confidence edges, and
 harmonizes gene identifiers.
 """
 
+import argparse
 import os
+import pickle
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from io_utils import gzip, open_input
 
 # Configuration: data sources and parameters
 DATA_DIR = "data/raw"
@@ -19,32 +33,44 @@ INTERACTION_SOURCES = {
         "filename": "starBase_ceRNA_interactions.tsv.gz",
         "sep": "\t",
         "score_col": "clip_score",
-        "threshold": 0.5
+        "threshold": 0.5,
+        "source_col": "miRNA",
+        "target_col": "target_gene"
     },
     "LncBase": {
         "url": "https://diana.e-ce.uth.gr/lncbasev2/download/LncBase_interactions.tsv.gz",
         "filename": "LncBase_interactions.tsv.gz",
         "sep": "\t",
         "score_col": "lncbase_confidence",
-        "threshold": 0.7
+        "threshold": 0.7,
+        "source_col": "miRNA",
+        "target_col": "target_gene"
     },
     "miRTarBase": {
         "url": "https://mirtarbase.cuhk.edu.cn/cache/download/2023_MTI.tsv.gz",
         "filename": "miRTarBase_interactions.tsv.gz",
         "sep": "\t",
         "score_col": "SupportType",  # e.g., 'strong_evidence'
-        "threshold": None  # assume all entries are experimentally validated
+        "threshold": None,  # assume all entries are experimentally validated
+        "source_col": "miRNA",
+        "target_col": "target_gene"
     },
     "miRcode": {
         "url": "http://www.mircode.org/download/mircode_v11.tsv",
         "filename": "miRcode_interactions.tsv",
         "sep": "\t",
         "score_col": None,  # no score column
-        "threshold": None
+        "threshold": None,
+        "source_col": "miRNA",
+        "target_col": "target_gene"
     }
 }
 
 ID_MAPPING_FILE = "data/annotations/gene_id_mapping.tsv"  # Tab-delimited: raw_id → official_symbol
+BLOCK_SIZE = 64 << 20  # bytes of CSV parsed per streamed batch in load_and_filter
+HEAD_BYTES = 4 << 20  # bytes requested per source by stream_head (--peek)
+OUTPUT_COLS = ['source', 'target', 'confidence_score']  # columns returned by load_and_filter
+ROW_GROUP_SIZE = 1 << 17  # rows per Parquet row group in the merged output (unit of partial reads)
 
 
 def ensure_data_dir():
@@ -52,10 +78,10 @@ def ensure_data_dir():
     os.makedirs(os.path.dirname(ID_MAPPING_FILE), exist_ok=True)
 
 
-def download_file(url: str, dest_path: str):
+def download_file(url: str, dest_path: str, session: requests.Session = None):
     """Download a file from a URL to a local destination."""
     print(f"Downloading {url} → {dest_path}")
-    resp = requests.get(url, stream=True)
+    resp = (session or requests).get(url, stream=True)
     resp.raise_for_status()
     with open(dest_path, "wb") as f:
         for chunk in resp.iter_content(chunk_size=8192):
@@ -63,13 +89,98 @@ def download_file(url: str, dest_path: str):
     print(f"Downloaded {dest_path}")
 
 
+def stream_head(url: str, max_rows: int, session: requests.Session = None) -> list:
+    """
+    Fetch the header line and first `max_rows` rows of a remote table.
+
+    Only the first HEAD_BYTES of the file are requested (HTTP Range) and
+    inflated incrementally; reading stops once enough lines are decoded.
+    Returns the raw lines, newline-terminated.
+    """
+    headers = {"Range": f"bytes=0-{HEAD_BYTES - 1}"}
+    lines = []
+    with (session or requests).get(url, stream=True, headers=headers) as resp:
+        resp.raise_for_status()
+        # 206 means the server honoured the range, so running out of data may be the range's doing
+        truncated = resp.status_code == 206
+        if url.endswith(".gz"):
+            stream = gzip.GzipFile(fileobj=resp.raw)
+        else:
+            resp.raw.decode_content = True
+            stream = resp.raw
+        try:
+            for line in stream:
+                lines.append(line)
+                if len(lines) > max_rows:
+                    break
+        except EOFError:
+            # the byte range ended mid-stream; keep the rows decoded so far
+            truncated = True
+    # drop a trailing row cut off by the byte range
+    if lines and not lines[-1].endswith(b"\n"):
+        lines.pop()
+    if truncated and len(lines) - 1 < max_rows:
+        print(f"  Warning: only {max(len(lines) - 1, 0)} of {max_rows} rows of {url} fit in "
+              f"the first {HEAD_BYTES} bytes; raise HEAD_BYTES for a larger peek")
+    return lines
+
+
+def download_source(info: dict, session: requests.Session = None, max_rows: int = None) -> str:
+    """
+    Download one INTERACTION_SOURCES entry unless it is already on disk.
+
+    If `max_rows` is given, only the head of the remote table is fetched
+    and written uncompressed under DATA_DIR/peek instead.
+    """
+    if max_rows is not None:
+        dest = os.path.join(DATA_DIR, "peek", info['filename'].removesuffix(".gz"))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        print(f"Fetching first {max_rows} rows of {info['url']} → {dest}")
+        lines = stream_head(info['url'], max_rows, session=session)
+        with open(dest, "wb") as f:
+            f.writelines(lines)
+        return dest
+
+    dest = os.path.join(DATA_DIR, info['filename'])
+    if not os.path.exists(dest):
+        download_file(info['url'], dest, session=session)
+    else:
+        print(f"{dest} already exists, skipping download.")
+    return dest
+
+
+def download_all(ready: queue.Queue, max_rows: int = None):
+    """
+    Download every source concurrently, putting (name, future) pairs on `ready`
+    as each finishes and a final None once all are done.
+    """
+    n_sources = len(INTERACTION_SOURCES)
+    try:
+        with requests.Session() as session:
+            adapter = HTTPAdapter(pool_connections=n_sources, pool_maxsize=n_sources)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            with ThreadPoolExecutor(max_workers=n_sources) as ex:
+                futures = {ex.submit(download_source, info, session, max_rows): name
+                           for name, info in INTERACTION_SOURCES.items()}
+                for fut in as_completed(futures):
+                    ready.put((futures[fut], fut))
+    finally:
+        ready.put(None)
+
+
 def load_and_filter(filepath: str,
                     sep: str = "\t",
                     score_col: str = None,
-                    threshold: float = None) -> pd.DataFrame:
+                    threshold: float = None,
+                    source_col: str = None,
+                    target_col: str = None) -> pd.DataFrame:
     """
     Load an interaction table and filter by confidence score.
 
+    Only the source, target and score columns are parsed; everything else
+    in the raw table is skipped by the CSV reader.
+
     Parameters
     ----------
     filepath : str
@@ -80,85 +191,192 @@ def load_and_filter(filepath: str,
         Name of the column containing confidence scores.
     threshold : float or None
         Minimum score to keep. If None, no filtering is applied.
+    source_col, target_col : str or None
+        Raw column names renamed to 'source' and 'target'. If missing from
+        the file, the first two columns are used instead.
 
     Returns
     -------
     pd.DataFrame
-        DataFrame with columns ['source', 'target', ...].
+        DataFrame with columns OUTPUT_COLS. `confidence_score` is NaN for
+        sources without a numeric score column; downstream filtering treats
+        such unscored edges as validated and keeps them.
     """
     print(f"Loading {filepath}")
-    df = pd.read_csv(filepath, sep=sep, compression='infer', low_memory=False)
-    # ensure we have `source` and `target` columns (rename if needed)
-    # Assuming raw columns named 'miRNA' and 'target_gene' or similar; adjust as needed:
-    if 'miRNA' in df.columns and 'target_gene' in df.columns:
-        df = df.rename(columns={'miRNA': 'source', 'target_gene': 'target'})
+    parse_options = pv.ParseOptions(delimiter=sep)
+    with open_input(filepath) as fh:
+        header = pv.open_csv(fh, parse_options=parse_options).schema.names
+    # ensure we have `source` and `target` columns (fall back to the first two)
+    if source_col not in header or target_col not in header:
+        source_col, target_col = header[0], header[1]
+    filter_score = bool(score_col) and threshold is not None and score_col in header
+    usecols = [source_col, target_col]
+    if score_col in header and score_col not in usecols:
+        usecols.append(score_col)
+    id_type = pa.dictionary(pa.int32(), pa.string())
+    column_types = {source_col: id_type, target_col: id_type}
+    if filter_score:
+        column_types[score_col] = pa.float32()
+        # compare in float32 so a score equal to the threshold (e.g. 0.7) is kept
+        min_score = pa.scalar(threshold, pa.float32())
+    convert_options = pv.ConvertOptions(include_columns=usecols,
+                                        column_types=column_types,
+                                        strings_can_be_null=True)
+
+    initial = 0
+    kept = []
+    with open_input(filepath) as fh:
+        # stream the table so only rows surviving the filters are held in memory
+        reader = pv.open_csv(fh,
+                             read_options=pv.ReadOptions(block_size=BLOCK_SIZE),
+                             parse_options=parse_options,
+                             convert_options=convert_options)
+        for batch in reader:
+            initial += batch.num_rows
+            # drop missing edges; duplicates are removed once, after merging all sources
+            mask = pc.and_(pc.is_valid(batch.column(source_col)),
+                           pc.is_valid(batch.column(target_col)))
+            # filter by confidence score
+            if filter_score:
+                mask = pc.and_(mask, pc.greater_equal(batch.column(score_col), min_score))
+            kept.append(batch.filter(mask))
+        schema = reader.schema
+
+    # each batch carries its own dictionary; unify them so the ids stay categorical
+    table = pa.Table.from_batches(kept, schema=schema).unify_dictionaries()
+    df = table.to_pandas().rename(columns={source_col: 'source',
+                                           target_col: 'target',
+                                           score_col: 'confidence_score'})
+    # non-numeric evidence labels (e.g. miRTarBase SupportType) carry no score
+    if 'confidence_score' in df.columns:
+        df['confidence_score'] = pd.to_numeric(df['confidence_score'], errors='coerce').astype('float32')
     else:
-        # fallback generic
-        df = df.rename(columns={df.columns[0]: 'source', df.columns[1]: 'target'})
-    
-    # filter by confidence score
-    if score_col and threshold is not None and score_col in df.columns:
-        initial = df.shape[0]
-        df = df[df[score_col] >= threshold]
-        print(f"  Filtered {initial - df.shape[0]} low-confidence edges (threshold={threshold})")
-    
-    # drop missing and duplicate edges
-    df = df.dropna(subset=['source', 'target'])
-    df = df.drop_duplicates(subset=['source', 'target'])
+        df['confidence_score'] = np.float32(np.nan)
+    print(f"  Dropped {initial - df.shape[0]} low-confidence or missing edges")
     print(f"  {df.shape[0]} interactions retained after filtering")
-    return df[['source', 'target'] + [c for c in df.columns if c not in ['source', 'target']] ]
+    return df[OUTPUT_COLS]
 
 
-def harmonize_ids(df: pd.DataFrame, mapping_path: str) -> pd.DataFrame:
+def load_mapping(mapping_path: str) -> dict:
     """
-    Harmonize gene/transcript IDs to official symbols using a mapping file.
+    Load the gene/transcript ID mapping as a raw_id → official_symbol dict.
+
+    The dict is cached next to the TSV as `<mapping_path>.pkl`, together with
+    the TSV's size and mtime; it is reused only while both still match.
 
     mapping_path : str
         TSV with columns ['raw_id', 'official_symbol'].
     """
+    cache_path = mapping_path + ".pkl"
+    st = os.stat(mapping_path)
+    source_stamp = (st.st_size, st.st_mtime_ns)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+        except Exception as e:  # a corrupt cache can raise almost anything when unpickled
+            print(f"  Ignoring unreadable cache {cache_path}: {e}")
+        else:
+            if isinstance(cached, dict) and cached.get("source_stamp") == source_stamp:
+                print(f"Loaded cached ID mapping from {cache_path}")
+                return cached["mapping"]
+            print(f"  Ignoring stale cache {cache_path}")
+
     print(f"Loading ID mapping from {mapping_path}")
-    mapping = pd.read_csv(mapping_path, sep="\t")
+    # read IDs as strings so numeric IDs (e.g. Entrez) match the string interaction ids
+    mapping = pd.read_csv(mapping_path, sep="\t", engine="pyarrow", dtype_backend="pyarrow",
+                          dtype={'raw_id': 'string[pyarrow]', 'official_symbol': 'string[pyarrow]'})
+    # rows without an official symbol leave the raw ID unchanged
+    mapping = mapping.dropna(subset=['official_symbol'])
     mapping_dict = dict(zip(mapping['raw_id'], mapping['official_symbol']))
-    
-    df['source'] = df['source'].map(mapping_dict).fillna(df['source'])
-    df['target'] = df['target'].map(mapping_dict).fillna(df['target'])
+    # write to a temp file and rename, so readers never see a partial cache;
+    # the cache is only an optimisation, so failing to write it is not fatal
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump({"source_stamp": source_stamp, "mapping": mapping_dict},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"  Could not write ID mapping cache {cache_path}: {e}")
+    return mapping_dict
+
+
+def apply_mapping(df: pd.DataFrame, mapping_dict: dict) -> pd.DataFrame:
+    """
+    Harmonize gene/transcript IDs to official symbols using a mapping dict.
+
+    Each column is factorized into integer codes; only the unique IDs are
+    looked up in the mapping, and the rows are remapped with a single
+    array gather. Categorical columns factorize without rehashing.
+    """
+    for col in ['source', 'target']:
+        codes, uniques = pd.factorize(df[col])
+        # several raw IDs may collapse onto one symbol, so re-factorize the mapped uniques
+        # an unmapped ID, or one mapped to a missing symbol, keeps its raw value
+        mapped = [mapping_dict.get(u) for u in uniques]
+        remap, symbols = pd.factorize(np.array([u if pd.isna(m) else m
+                                                for u, m in zip(uniques, mapped)],
+                                               dtype=object))
+        new_codes = np.where(codes < 0, -1, np.take(remap, codes))
+        df[col] = pd.Categorical.from_codes(new_codes, categories=symbols)
     return df
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Download, filter and merge ceRNA interaction tables")
+    parser.add_argument('--peek', type=int, metavar='N', default=None,
+                        help="Only fetch and process the first N rows of each source "
+                             "(for schema checks); the output is written to a .peek.parquet file")
+    args = parser.parse_args()
+
     ensure_data_dir()
     
-    # 1. Download raw tables
-    for name, info in INTERACTION_SOURCES.items():
-        dest = os.path.join(DATA_DIR, info['filename'])
-        if not os.path.exists(dest):
-            download_file(info['url'], dest)
-        else:
-            print(f"{dest} already exists, skipping download.")
-    
+    # 1. Download raw tables in the background; parse each one as soon as it lands
+    ready = queue.Queue(maxsize=2)
+    threading.Thread(target=download_all, args=(ready, args.peek), daemon=True).start()
+
     # 2. Load, filter, and harmonize each source
-    dfs = []
-    for name, info in INTERACTION_SOURCES.items():
-        path = os.path.join(DATA_DIR, info['filename'])
+    mapping_dict = load_mapping(ID_MAPPING_FILE)
+    dfs = {}
+    while (item := ready.get()) is not None:
+        name, fut = item
+        info = INTERACTION_SOURCES[name]
+        path = fut.result()  # re-raises a failed download
         df = load_and_filter(
             filepath=path,
             sep=info['sep'],
             score_col=info['score_col'],
-            threshold=info['threshold']
+            threshold=info['threshold'],
+            source_col=info['source_col'],
+            target_col=info['target_col']
         )
-        df = harmonize_ids(df, ID_MAPPING_FILE)
+        df = apply_mapping(df, mapping_dict)
         df['source_db'] = name
-        dfs.append(df)
+        # Arrow-backed strings keep the merged edge list compact and hash fast
+        df = df.astype({'source': 'string[pyarrow]',
+                        'target': 'string[pyarrow]',
+                        'source_db': 'string[pyarrow]'})
+        dfs[name] = df
     
-    # 3. Merge all into a single edge list
-    merged = pd.concat(dfs, ignore_index=True)
-    merged = merged.drop_duplicates(subset=['source', 'target'])
+    # 3. Merge all into a single edge list (in config order, so dedup is deterministic)
+    merged = pd.concat([dfs[name] for name in INTERACTION_SOURCES], ignore_index=True)
+    # single dedup pass over one uint64 hash per (source, target) pair;
+    # the row hash is order-sensitive, so (a, b) and (b, a) stay distinct
+    pair_hash = pd.util.hash_pandas_object(merged[['source', 'target']], index=False)
+    merged = merged.loc[~pair_hash.duplicated().to_numpy()]
     print(f"Total unique interactions across all databases: {merged.shape[0]}")
     
     # 4. Save merged edge list
-    out_path = "data/processed/ceRNA_interactions_merged.tsv"
+    out_path = "data/processed/ceRNA_interactions_merged.parquet"
+    if args.peek is not None:
+        out_path = out_path.replace(".parquet", ".peek.parquet")
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    merged.to_csv(out_path, sep="\t", index=False)
+    merged.to_parquet(out_path, compression="zstd", index=False, row_group_size=ROW_GROUP_SIZE)
     print(f"Merged interactions saved to {out_path}")
 
 
@@ -9,58 +9,115 @@ and saves the filtered expression matrix.
 
 import os
 import argparse
+import anndata as ad
+import numpy as np
 import pandas as pd
+from scipy import sparse
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 
-def load_network_genes(network_path: str) -> set:
+from io_utils import open_input
+
+BLOCK_SIZE = 16 << 20  # bytes of the expression matrix parsed per streamed batch
+
+def load_network_genes(network_path: str) -> frozenset:
     """
-    Load the ceRNA network edge list and return the set of all genes/lncRNAs/circRNAs.
+    Load the ceRNA network edge list and return the frozenset of all genes/lncRNAs/circRNAs.
+    Parquet edge lists are read column-projected; anything else is parsed as TSV.
     """
-    df = pd.read_csv(network_path, sep='\t', usecols=['source', 'target'])
-    genes = set(df['source']).union(df['target'])
+    columns = ['source', 'target']
+    if network_path.endswith('.parquet'):
+        table = pq.read_table(network_path, columns=columns)
+    else:
+        with open_input(network_path) as fh:
+            # ids are strings; empty fields become nulls and are dropped below
+            convert_options = pv.ConvertOptions(include_columns=columns,
+                                                column_types={c: pa.string() for c in columns},
+                                                strings_can_be_null=True)
+            table = pv.read_csv(fh,
+                                parse_options=pv.ParseOptions(delimiter='\t'),
+                                convert_options=convert_options)
+    # unique values are extracted per column in Arrow, then unioned
+    sources = pc.unique(table['source']).cast(pa.string())
+    targets = pc.unique(table['target']).cast(pa.string())
+    nodes = pc.unique(pa.concat_arrays([sources, targets])).drop_null()
+    genes = frozenset(nodes.to_pylist())
     print(f"[Network] Loaded {len(genes)} unique nodes from {network_path}")
     return genes
 
-def load_expression(expr_path: str) -> pd.DataFrame:
+def load_expression(expr_path: str) -> ad.AnnData:
     """
-    Load scRNA-seq expression matrix.
+    Load scRNA-seq expression matrix as a sparse AnnData object (cells x genes).
     Expects a tab- or comma-delimited file with genes as rows and cells as columns,
     and the first column named 'gene' or used as the row index.
     """
-    # Try TSV first, then CSV
-    sep = '\t'
-    try:
-        expr = pd.read_csv(expr_path, sep=sep, index_col=0)
-    except Exception:
-        sep = ','
-        expr = pd.read_csv(expr_path, sep=sep, index_col=0)
-    print(f"[Expression] Loaded expression matrix with {expr.shape[0]} genes and {expr.shape[1]} cells")
-    return expr
-
-def filter_expression(expr: pd.DataFrame, network_genes: set) -> pd.DataFrame:
+    # Try TSV first, then CSV (a CSV read as TSV collapses to a single column)
+    read_options = pv.ReadOptions(block_size=BLOCK_SIZE)  # must fit the (wide) header line
+    for sep in ['\t', ',']:
+        parse_options = pv.ParseOptions(delimiter=sep)
+        with open_input(expr_path) as fh:
+            header = pv.open_csv(fh, read_options=read_options,
+                                 parse_options=parse_options).schema.names
+        if len(header) > 1:
+            break
+    gene_col, cells = header[0], header[1:]
+    convert_options = pv.ConvertOptions(
+        column_types={gene_col: pa.string(), **{c: pa.float32() for c in cells}})
+
+    # stream the matrix, keeping only a sparse copy of each parsed block
+    genes = []
+    blocks = []
+    with open_input(expr_path) as fh:
+        reader = pv.open_csv(fh,
+                             read_options=read_options,
+                             parse_options=parse_options,
+                             convert_options=convert_options)
+        for batch in reader:
+            genes.extend(batch.column(0).to_pylist())
+            dense = np.column_stack([batch.column(i).to_numpy(zero_copy_only=False)
+                                     for i in range(1, batch.num_columns)])
+            blocks.append(sparse.csr_matrix(dense))
+    if blocks:
+        X = sparse.vstack(blocks, format='csr')
+    else:
+        X = sparse.csr_matrix((0, len(cells)), dtype=np.float32)
+
+    # genes x cells on disk; AnnData is cells x genes
+    adata = ad.AnnData(X=X.T.tocsr(),
+                       obs=pd.DataFrame(index=pd.Index(cells, dtype=str)),
+                       var=pd.DataFrame(index=pd.Index(genes, dtype=str)))
+    print(f"[Expression] Loaded expression matrix with {adata.n_vars} genes and {adata.n_obs} cells")
+    return adata
+
+def filter_expression(adata: ad.AnnData, network_genes: frozenset) -> ad.AnnData:
     """
     Filter the expression matrix to:
       1) Keep only genes present in the ceRNA network.
       2) Remove genes with zero expression across all cells.
     """
     # Intersect with network genes
-    genes_before = expr.shape[0]
-    expr = expr.loc[expr.index.intersection(network_genes)]
-    print(f"[Filter] {genes_before - expr.shape[0]} genes removed (not in network)")
+    genes_before = adata.n_vars
+    in_network = adata.var_names.isin(network_genes)
+    adata = adata[:, in_network].copy()
+    print(f"[Filter] {genes_before - adata.n_vars} genes removed (not in network)")
 
-    # Remove zero-expression genes
-    nonzero = (expr.sum(axis=1) > 0)
-    expr = expr.loc[nonzero]
+    # Remove zero-expression genes (any nonzero value, including negative, keeps a gene)
+    adata.X.eliminate_zeros()
+    nonzero = adata.X.getnnz(axis=0) > 0
+    adata = adata[:, nonzero].copy()
     print(f"[Filter] {nonzero.size - nonzero.sum()} genes removed (zero expression)")
 
-    print(f"[Filter] {expr.shape[0]} genes remain after filtering")
-    return expr
+    print(f"[Filter] {adata.n_vars} genes remain after filtering")
+    return adata
 
-def save_expression(expr: pd.DataFrame, out_path: str):
+def save_expression(adata: ad.AnnData, out_path: str):
     """
-    Save the filtered expression matrix to a file.
+    Save the filtered expression matrix to an .h5ad file.
     """
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    expr.to_csv(out_path, sep='\t')
+    adata.write_h5ad(out_path)
     print(f"[Output] Filtered expression saved to {out_path}")
 
 def main():
@@ -68,16 +125,16 @@ def main():
     parser.add_argument('--expr', required=True,
                         help="Path to the normalized scRNA-seq expression matrix (genes x cells)")
     parser.add_argument('--network', required=True,
-                        help="Path to the merged ceRNA network edge list (tab-delim, columns 'source','target')")
+                        help="Path to the merged ceRNA network edge list (Parquet or tab-delim, columns 'source','target')")
     parser.add_argument('--out', required=True,
-                        help="Output path for the filtered expression matrix")
+                        help="Output path for the filtered expression matrix (.h5ad)")
 
     args = parser.parse_args()
 
     network_genes = load_network_genes(args.network)
-    expr = load_expression(args.expr)
-    expr_filtered = filter_expression(expr, network_genes)
-    save_expression(expr_filtered, args.out)
+    adata = load_expression(args.expr)
+    adata_filtered = filter_expression(adata, network_genes)
+    save_expression(adata_filtered, args.out)
 
 if __name__ == "__main__":
     main()